@@ -1,10 +1,17 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash
+from flask import Flask, render_template, request, redirect, url_for, session, flash, abort
 import spotipy
-from spotipy.oauth2 import SpotifyOAuth
+from cachetools import TTLCache, cached
+from diskcache import Cache
 import logging
-from random import shuffle, choice
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import hmac
 import os
 from dotenv import load_dotenv
+from spotify_utils import (
+    REQUEST_LIMIT, PAGE_WORKERS, TRACK_RANGES,
+    LockingSpotifyOAuth, build_session, call_with_backoff, page_track_ids, draw_track_lists, playlist_names
+)
 
 # Load environment variables
 load_dotenv()
@@ -26,43 +33,102 @@ SPOTIFY_CLIENT_ID = os.getenv('SPOTIFY_CLIENT_ID')
 SPOTIFY_CLIENT_SECRET = os.getenv('SPOTIFY_CLIENT_SECRET')
 SPOTIFY_REDIRECT_URI = os.getenv('SPOTIFY_REDIRECT_URI', 'http://localhost:5000/callback')
 
+# Playlist cache configuration
+PLAYLIST_CACHE_DIR = os.getenv('PLAYLIST_CACHE_DIR', '.playlist_cache')
+PLAYLIST_CACHE_SIZE_MB = int(os.getenv('PLAYLIST_CACHE_SIZE_MB', '100'))
+CLEAR_CACHE_TOKEN = os.getenv('CLEAR_CACHE_TOKEN')
+
 # Constants
-REQUEST_LIMIT = 100
-TRACK_RANGES = {
-    'tracks1': (999, 2000, 2),
-    'tracks2': (1999, 3000, 2),
-    'tracks3': (399, 900, 1)
-}
-
-# Name generation data
-ADJECTIVES = [
-    "Different", "Important", "Popular", "Creative", "Unique", "Mysterious", "Energetic",
-    "Peaceful", "Vibrant", "Magical", "Wild", "Gentle", "Bold", "Cosmic", "Dreamy"
-]
-
-ANIMAL_NAMES = [
-    "Wolf", "Eagle", "Dolphin", "Tiger", "Owl", "Fox", "Bear", "Lion", "Hawk",
-    "Panther", "Dragon", "Phoenix", "Raven", "Leopard", "Falcon"
-]
+PLAYLISTS_LIMIT = 50
+PLAYLIST_ITEM_FIELDS = "items(track(id)),total"
+PLAYLISTS_CACHE_TTL = 300  # seconds
+
+# Shared Spotify client, created lazily on first use
+_SPOTIFY = None
+_SPOTIFY_LOCK = threading.Lock()
+_USER_ID = None
+
+# Track IDs per playlist, persisted on disk and shared between worker processes
+_PLAYLIST_CACHE = Cache(PLAYLIST_CACHE_DIR, size_limit=PLAYLIST_CACHE_SIZE_MB * 1024 * 1024)
 
 def get_spotify():
     """Create or get Spotify client."""
-    auth_manager = SpotifyOAuth(
-        client_id=SPOTIFY_CLIENT_ID,
-        client_secret=SPOTIFY_CLIENT_SECRET,
-        redirect_uri=SPOTIFY_REDIRECT_URI,
-        scope="user-library-read playlist-modify-public",
-        cache_path=".cache"
-    )
-    return spotipy.Spotify(auth_manager=auth_manager)
+    global _SPOTIFY
+    if _SPOTIFY is None:
+        with _SPOTIFY_LOCK:
+            if _SPOTIFY is None:
+                # API calls and token refreshes share one pool of kept-alive connections
+                http_session = build_session()
+                auth_manager = LockingSpotifyOAuth(
+                    client_id=SPOTIFY_CLIENT_ID,
+                    client_secret=SPOTIFY_CLIENT_SECRET,
+                    redirect_uri=SPOTIFY_REDIRECT_URI,
+                    scope="user-library-read playlist-modify-public",
+                    cache_path=".cache",
+                    requests_session=http_session
+                )
+                _SPOTIFY = spotipy.Spotify(auth_manager=auth_manager, requests_session=http_session)
+    return _SPOTIFY
+
+def _user_id():
+    """Get the ID of the authenticated user, looked up once and then cached."""
+    global _USER_ID
+    if _USER_ID is None:
+        _USER_ID = call_with_backoff(get_spotify().me)['id']
+    return _USER_ID
+
+def fetch_playlist_track_ids(sp, playlist_id):
+    """Fetch the unique track IDs of a playlist, requesting the remaining pages concurrently."""
+    results = call_with_backoff(sp.playlist_items, playlist_id, fields=PLAYLIST_ITEM_FIELDS,
+                                limit=REQUEST_LIMIT, additional_types=('track',))
+    track_ids = page_track_ids(results)
+
+    def get_page(offset):
+        return call_with_backoff(sp.playlist_items, playlist_id, fields=PLAYLIST_ITEM_FIELDS,
+                                 limit=REQUEST_LIMIT, offset=offset, additional_types=('track',))
+
+    # The first page tells us the total, so every other offset is known up front
+    offsets = range(REQUEST_LIMIT, results['total'], REQUEST_LIMIT)
+    with ThreadPoolExecutor(max_workers=PAGE_WORKERS) as executor:
+        for page in executor.map(get_page, offsets):
+            track_ids.extend(page_track_ids(page))
+    # Drop repeated tracks, keeping the first occurrence, so no track is drawn twice
+    return list(dict.fromkeys(track_ids))
+
+def get_playlist_track_ids(sp, playlist_id):
+    """Get playlist track IDs, reusing the cached copy while the playlist snapshot is unchanged."""
+    snapshot_id = call_with_backoff(sp.playlist, playlist_id, fields="snapshot_id")['snapshot_id']
+    cached_entry = _PLAYLIST_CACHE.get(playlist_id)
+    if cached_entry and cached_entry[0] == snapshot_id:
+        return cached_entry[1]
+
+    track_ids = fetch_playlist_track_ids(sp, playlist_id)
+    _PLAYLIST_CACHE.set(playlist_id, (snapshot_id, track_ids))
+    return track_ids
+
+@cached(cache=TTLCache(maxsize=256, ttl=PLAYLISTS_CACHE_TTL), lock=threading.Lock())
+def _cached_user_playlists(username):
+    """Fetch all public playlists for a given username, cached for a few minutes."""
+    sp = get_spotify()
+    results = call_with_backoff(sp.user_playlists, username, limit=PLAYLISTS_LIMIT)
+    playlists = list(results['items'])
+
+    def get_page(offset):
+        return call_with_backoff(sp.user_playlists, username, limit=PLAYLISTS_LIMIT, offset=offset)
+
+    # As with playlist items, the first page gives the total and the rest are fetched concurrently
+    offsets = range(PLAYLISTS_LIMIT, results['total'], PLAYLISTS_LIMIT)
+    with ThreadPoolExecutor(max_workers=PAGE_WORKERS) as executor:
+        for page in executor.map(get_page, offsets):
+            playlists.extend(page['items'])
+
+    return [{'id': pl['id'], 'name': pl['name'], 'tracks': pl['tracks']['total']} 
+            for pl in playlists]
 
 def get_user_playlists(username):
     """Get public playlists for a given username."""
     try:
-        sp = get_spotify()
-        playlists = sp.user_playlists(username)
-        return [{'id': pl['id'], 'name': pl['name'], 'tracks': pl['tracks']['total']} 
-                for pl in playlists['items']]
+        return _cached_user_playlists(username)
     except Exception as e:
         logger.error(f"Error fetching playlists for {username}: {e}")
         return None
@@ -71,48 +137,41 @@ def process_playlist(playlist_id):
     """Process a playlist and create new derivative playlists."""
     try:
         sp = get_spotify()
-        tracks = []
         
         # Get playlist tracks
-        results = sp.playlist_items(playlist_id)
-        tracks.extend(results['items'])
-        while results['next']:
-            results = sp.next(results)
-            tracks.extend(results['items'])
-        
-        # Shuffle tracks
-        shuffle(tracks)
-        shuffle(tracks)
+        tracks = get_playlist_track_ids(sp, playlist_id)
         
-        # Process into separate lists
-        track_lists = {}
-        for list_name, (start, end, step) in TRACK_RANGES.items():
-            track_subset = tracks[start:end:step]
-            track_lists[list_name] = [val['track']['id'] for val in track_subset if val['track'] and val['track']['id']]
+        # tracks is a fresh copy from the cache or the API, so it can be shuffled in place
+        track_lists = draw_track_lists(tracks)
         
-        # Create new playlists
-        created_playlists = []
-        for list_name, track_list in track_lists.items():
-            if track_list:
-                nomen = f"{choice(ADJECTIVES)} {choice(ANIMAL_NAMES)}"
-                playlist = sp.user_playlist_create(
-                    sp.me()['id'],
-                    nomen,
-                    public=True,
-                    description=f'Generated from playlist {playlist_id}'
-                )
-                
-                # Add tracks in batches
-                for i in range(0, len(track_list), 100):
-                    batch = track_list[i:i+100]
-                    if batch:
-                        sp.playlist_add_items(playlist['id'], batch)
-                
-                created_playlists.append({
-                    'name': nomen,
-                    'id': playlist['id'],
-                    'url': f"https://open.spotify.com/playlist/{playlist['id']}"
-                })
+        # Create new playlists, building each one concurrently
+        user_id = _user_id()
+
+        def build_playlist(nomen, track_list):
+            playlist = call_with_backoff(
+                sp.user_playlist_create,
+                user_id,
+                nomen,
+                public=True,
+                description=f'Generated from playlist {playlist_id}'
+            )
+            
+            # Add tracks in batches
+            for i in range(0, len(track_list), 100):
+                batch = track_list[i:i+100]
+                if batch:
+                    call_with_backoff(sp.playlist_add_items, playlist['id'], batch)
+            
+            return {
+                'name': nomen,
+                'id': playlist['id'],
+                'url': f"https://open.spotify.com/playlist/{playlist['id']}"
+            }
+
+        non_empty = [track_list for track_list in track_lists.values() if track_list]
+        names = playlist_names(len(non_empty))
+        with ThreadPoolExecutor(max_workers=len(TRACK_RANGES)) as executor:
+            created_playlists = list(executor.map(build_playlist, names, non_empty))
         
         return created_playlists
     except Exception as e:
@@ -149,6 +208,20 @@ def process(playlist_id):
     
     return render_template('results.html', playlists=created_playlists)
 
+@app.route('/clear-cache', methods=['POST'])
+def clear_cache():
+    """Drop all cached playlist data. Requires the CLEAR_CACHE_TOKEN admin token."""
+    if not CLEAR_CACHE_TOKEN:
+        abort(404)
+    token = request.headers.get('X-Clear-Cache-Token') or request.form.get('token', '')
+    if not hmac.compare_digest(token.encode(), CLEAR_CACHE_TOKEN.encode()):
+        abort(403)
+    _PLAYLIST_CACHE.clear()
+    _cached_user_playlists.cache_clear()
+    logger.info("Cleared playlist caches")
+    flash('Playlist cache cleared', 'success')
+    return redirect(url_for('index'))
+
 @app.route('/callback')
 def callback():
     """Handle Spotify OAuth callback."""
@@ -1,9 +1,15 @@
 import spotipy
-from spotipy.oauth2 import SpotifyOAuth
-from random import shuffle, choice
+from random import randrange
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from itertools import islice
 import logging
 import os
 from typing import Dict, List
+from spotify_utils import (
+    REQUEST_LIMIT, PAGE_WORKERS, TRACK_RANGES,
+    LockingSpotifyOAuth, build_session, call_with_backoff, page_track_ids, draw_track_lists, playlist_names
+)
 
 # Configure logging
 logging.basicConfig(
@@ -16,13 +22,15 @@ logger = logging.getLogger(__name__)
 SPOTIFY_CLIENT_ID = os.getenv('SPOTIFY_CLIENT_ID')
 SPOTIFY_CLIENT_SECRET = os.getenv('SPOTIFY_CLIENT_SECRET')
 
-# Spotify API Authentication
-sp = spotipy.Spotify(auth_manager=SpotifyOAuth(
+# Spotify API Authentication, sharing one pool of kept-alive connections
+http_session = build_session()
+sp = spotipy.Spotify(auth_manager=LockingSpotifyOAuth(
     client_id=SPOTIFY_CLIENT_ID,
     client_secret=SPOTIFY_CLIENT_SECRET,
     redirect_uri="https://lucidbeaming.com",
-    scope="user-library-read playlist-modify-public"
-))
+    scope="user-library-read playlist-modify-public",
+    requests_session=http_session
+), requests_session=http_session)
 
 def verify_spotify_auth():
     """
@@ -31,7 +39,7 @@ def verify_spotify_auth():
     """
     try:
         # Test basic authentication by getting current user
-        user = sp.current_user()
+        user = call_with_backoff(sp.current_user)
         if not user:
             logger.error("Could not retrieve user information. Authentication failed.")
             return False
@@ -39,7 +47,7 @@ def verify_spotify_auth():
 
         # Test playlist reading permissions
         try:
-            sp.current_user_playlists(limit=1)
+            call_with_backoff(sp.current_user_playlists, limit=1)
             logger.info("✓ Playlist reading permission verified")
         except Exception as e:
             logger.error(f"Playlist reading permission test failed: {str(e)}")
@@ -48,7 +56,8 @@ def verify_spotify_auth():
 
         # Test playlist creation permissions
         try:
-            test_playlist = sp.user_playlist_create(
+            test_playlist = call_with_backoff(
+                sp.user_playlist_create,
                 user['id'],
                 "Test Playlist (Will be Deleted)",
                 public=False,
@@ -57,7 +66,7 @@ def verify_spotify_auth():
             logger.info("✓ Playlist creation permission verified")
             
             # Clean up test playlist
-            sp.current_user_unfollow_playlist(test_playlist['id'])
+            call_with_backoff(sp.current_user_unfollow_playlist, test_playlist['id'])
             logger.info("✓ Test playlist cleaned up")
         except Exception as e:
             logger.error(f"Playlist creation permission test failed: {str(e)}")
@@ -66,7 +75,7 @@ def verify_spotify_auth():
 
         # Test library access permissions
         try:
-            sp.current_user_saved_tracks(limit=1)
+            call_with_backoff(sp.current_user_saved_tracks, limit=1)
             logger.info("✓ Library access permission verified")
         except Exception as e:
             logger.error(f"Library access permission test failed: {str(e)}")
@@ -87,15 +96,10 @@ def verify_spotify_auth():
         return False
 
 # Constants
-REQUEST_LIMIT = 100
 SOURCE_PLAYLIST_ID = "2iy3nUibZu1C6SvlMKEPJv"
-TRACK_RANGES = {
-    'tracks1': (999, 2000, 2),    # start, end, step
-    'tracks2': (1999, 3000, 2),
-    'tracks3': (399, 900, 1)
-}
+RESERVOIR_SIZE = max(end for _, end, _ in TRACK_RANGES.values())
 
-# Lists for storing track data
+# Lists for storing track data (track IDs only)
 tracks = []
 track_lists = {
     'tracks1': [],
@@ -106,74 +110,86 @@ track_lists = {
 def get_playlist_tracks(playlist_id, fields=None, limit=REQUEST_LIMIT, offset=0, market=None, additional_types=('track', 'episode')):
     """Fetch tracks from a playlist with error handling."""
     try:
-        return sp.playlist_items(playlist_id, fields, limit, offset, market, additional_types)
+        return call_with_backoff(sp.playlist_items, playlist_id, fields, limit, offset, market, additional_types)
     except Exception as e:
         logger.error(f"Error fetching playlist tracks: {e}")
         return None
 
-def fetch_and_shuffle_tracks():
-    """Fetch all tracks from source playlist and shuffle them."""
+def iter_playlist_track_ids(playlist_id, total_tracks):
+    """Yield the track IDs of a playlist page by page, as each page arrives."""
+    def get_page(offset):
+        return get_playlist_tracks(
+            playlist_id,
+            "items(track(id))",
+            REQUEST_LIMIT,
+            offset
+        )
+
+    # Fetch all tracks in batches, keeping at most PAGE_WORKERS pages in flight or buffered
+    # ahead of the consumer; a new page is requested only as the oldest one is handed over
+    offsets = iter(range(0, total_tracks, REQUEST_LIMIT))
+    with ThreadPoolExecutor(max_workers=PAGE_WORKERS) as executor:
+        pending = deque((i, executor.submit(get_page, i)) for i in islice(offsets, PAGE_WORKERS))
+        while pending:
+            i, future = pending.popleft()
+            request_buffer = future.result()
+            next_offset = next(offsets, None)
+            if next_offset is not None:
+                pending.append((next_offset, executor.submit(get_page, next_offset)))
+            if request_buffer:
+                logger.info(f"Fetched tracks {i} to {min(i + REQUEST_LIMIT, total_tracks)}")
+                yield from page_track_ids(request_buffer)
+
+def reservoir_sample(items, k):
+    """Keep a uniform random sample of up to k items from an iterable in one pass (Algorithm R)."""
+    reservoir = []
+    for i, item in enumerate(items):
+        if i < k:
+            reservoir.append(item)
+        else:
+            j = randrange(i + 1)
+            if j < k:
+                reservoir[j] = item
+    return reservoir
+
+def fetch_tracks():
+    """Fetch tracks from source playlist, keeping only as many as the ranges can use."""
     try:
         # Get total number of tracks
-        playlist_info = get_playlist_tracks(SOURCE_PLAYLIST_ID)
+        playlist_info = get_playlist_tracks(SOURCE_PLAYLIST_ID, "total", 1)
         if not playlist_info:
             return False
         
         total_tracks = playlist_info["total"]
         logger.info(f"Total tracks to process: {total_tracks}")
 
-        # Fetch all tracks in batches
-        for i in range(0, total_tracks, REQUEST_LIMIT):
-            request_buffer = get_playlist_tracks(
-                SOURCE_PLAYLIST_ID,
-                "items(track(name,id))",
-                REQUEST_LIMIT,
-                i
-            )
-            if request_buffer:
-                tracks.extend(request_buffer["items"])
-                logger.info(f"Fetched tracks {i} to {min(i + REQUEST_LIMIT, total_tracks)}")
-
-        # Double shuffle for better randomization
-        shuffle(tracks)
-        shuffle(tracks)
+        # Positions past RESERVOIR_SIZE are never read, so only a sample of that size is retained.
+        # Bounded memory wins over exact dedup: repeats are dropped within the reservoir only, so
+        # no track is drawn twice, but a track listed twice in the source is likelier to be kept.
+        tracks.extend(dict.fromkeys(reservoir_sample(iter_playlist_track_ids(SOURCE_PLAYLIST_ID, total_tracks), RESERVOIR_SIZE)))
         return True
     except Exception as e:
-        logger.error(f"Error in fetch_and_shuffle_tracks: {e}")
+        logger.error(f"Error in fetch_tracks: {e}")
         return False
 
 def process_track_lists():
     """Process tracks into separate lists based on defined ranges."""
     try:
-        for list_name, (start, end, step) in TRACK_RANGES.items():
-            track_subset = tracks[start:end:step]
-            track_lists[list_name] = [val['track']['id'] for val in track_subset if val['track']['id'] is not None]
+        track_lists.update(draw_track_lists(tracks))
+        for list_name in track_lists:
             logger.info(f"Processed {len(track_lists[list_name])} tracks for {list_name}")
         return True
     except Exception as e:
         logger.error(f"Error processing track lists: {e}")
         return False
 
-# Name generation data
-ADJECTIVES = [
-    "Different", "Important", "Popular", "Creative", "Unique", "Mysterious", "Energetic",
-    "Peaceful", "Vibrant", "Magical", "Wild", "Gentle", "Bold", "Cosmic", "Dreamy"
-]
-
-ANIMAL_NAMES = [
-    "Wolf", "Eagle", "Dolphin", "Tiger", "Owl", "Fox", "Bear", "Lion", "Hawk",
-    "Panther", "Dragon", "Phoenix", "Raven", "Leopard", "Falcon"
-]
-
-def create_and_populate_playlist(track_list: List[str]) -> str:
+def create_and_populate_playlist(nomen: str, track_list: List[str]) -> str:
     """Create a new playlist and populate it with tracks. Returns playlist ID if successful."""
     try:
-        # Generate playlist name using adjective-animal style
-        nomen = f"{choice(ADJECTIVES)} {choice(ANIMAL_NAMES)}"
-
         # Create playlist
-        playlist = sp.user_playlist_create(
-            sp.me()['id'],
+        playlist = call_with_backoff(
+            sp.user_playlist_create,
+            call_with_backoff(sp.me)['id'],
             nomen,
             public=True,
             collaborative=False,
@@ -185,7 +201,7 @@ def create_and_populate_playlist(track_list: List[str]) -> str:
         for i in range(100, 300, 100):
             batch = track_list[i:i+100]
             if batch:
-                sp.playlist_add_items(playlist['id'], batch)
+                call_with_backoff(sp.playlist_add_items, playlist['id'], batch)
                 logger.info(f"Added {len(batch)} tracks to {nomen}")
 
         return playlist['id']
@@ -196,11 +212,11 @@ def create_and_populate_playlist(track_list: List[str]) -> str:
 def display_playlist_contents(playlist_id: str) -> None:
     """Display the contents of a playlist."""
     try:
-        playlist = sp.playlist(playlist_id)
+        playlist = call_with_backoff(sp.playlist, playlist_id)
         logger.info(f"\nPlaylist: {playlist['name']}")
         logger.info("-" * 50)
         
-        tracks = sp.playlist_tracks(playlist_id)
+        tracks = call_with_backoff(sp.playlist_tracks, playlist_id)
         for i, item in enumerate(tracks['items'], 1):
             track = item['track']
             artists = ", ".join([artist['name'] for artist in track['artists']])
@@ -221,8 +237,8 @@ def main():
         return
 
     # Part 1: Fetch and process tracks
-    logger.info("1. Fetching and shuffling tracks...")
-    if not fetch_and_shuffle_tracks():
+    logger.info("1. Fetching tracks...")
+    if not fetch_tracks():
         return
     
     logger.info("2. Processing track lists...")
@@ -232,8 +248,9 @@ def main():
     logger.info("3. Creating and populating playlists...")
     # Create three playlists and store their IDs
     playlist_ids = {}
-    for list_name in track_lists:
-        playlist_id = create_and_populate_playlist(track_lists[list_name])
+    names = playlist_names(len(track_lists))
+    for nomen, list_name in zip(names, track_lists):
+        playlist_id = create_and_populate_playlist(nomen, track_lists[list_name])
         if playlist_id:
             playlist_ids[list_name] = playlist_id
 
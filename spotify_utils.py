@@ -0,0 +1,141 @@
+import logging
+import threading
+import time
+from random import choices, randrange
+
+import orjson
+import requests
+from requests.adapters import HTTPAdapter
+from spotipy.exceptions import SpotifyException
+from spotipy.oauth2 import SpotifyOAuth
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+# Constants
+REQUEST_LIMIT = 100
+PAGE_WORKERS = 10
+MAX_RETRIES = 5
+MAX_RETRY_AFTER = 30  # seconds; longer rate-limit windows are surfaced instead of waited out
+HTTP_POOL_SIZE = 20
+TRACK_RANGES = {
+    'tracks1': (999, 2000, 2),    # start, end, step
+    'tracks2': (1999, 3000, 2),
+    'tracks3': (399, 900, 1)
+}
+# TRACK_RANGES as (name, range of positions), built once at import
+_RANGE_POSITIONS = [(list_name, range(start, end, step))
+                    for list_name, (start, end, step) in TRACK_RANGES.items()]
+
+# Name generation data
+ADJECTIVES = (
+    "Different", "Important", "Popular", "Creative", "Unique", "Mysterious", "Energetic",
+    "Peaceful", "Vibrant", "Magical", "Wild", "Gentle", "Bold", "Cosmic", "Dreamy"
+)
+
+ANIMAL_NAMES = (
+    "Wolf", "Eagle", "Dolphin", "Tiger", "Owl", "Fox", "Bear", "Lion", "Hawk",
+    "Panther", "Dragon", "Phoenix", "Raven", "Leopard", "Falcon"
+)
+
+# Caps Spotify requests in flight across all threads
+_API_SEMAPHORE = threading.BoundedSemaphore(PAGE_WORKERS)
+
+class LockingSpotifyOAuth(SpotifyOAuth):
+    """SpotifyOAuth that serializes token lookups across threads.
+
+    Every API call asks the auth manager for a token, so without the lock several
+    workers could refresh an expiring token at once and rewrite the token cache
+    file concurrently.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._token_lock = threading.RLock()
+
+    def get_access_token(self, *args, **kwargs):
+        with self._token_lock:
+            return super().get_access_token(*args, **kwargs)
+
+def orjson_response(response, *args, **kwargs):
+    """Response hook that decodes JSON bodies with orjson instead of the stdlib json module."""
+    response.json = lambda **_: orjson.loads(response.content)
+    return response
+
+def build_session():
+    """Create a pooled, keep-alive HTTP session retrying transient server errors."""
+    # Same methods spotipy's own session retries, POST included. A final 5xx is returned
+    # rather than raised so spotipy reports the real status. 429 is left to call_with_backoff.
+    retry = Retry(
+        total=3,
+        backoff_factor=0.5,
+        status_forcelist=(500, 502, 503, 504),
+        allowed_methods=frozenset(['GET', 'POST', 'PUT', 'DELETE']),
+        raise_on_status=False,
+        respect_retry_after_header=False
+    )
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.hooks['response'].append(orjson_response)
+    return session
+
+def call_with_backoff(fn, *args, **kwargs):
+    """Call a Spotify API method, honouring Retry-After when rate limited (HTTP 429)."""
+    for attempt in range(MAX_RETRIES):
+        try:
+            with _API_SEMAPHORE:
+                return fn(*args, **kwargs)
+        except SpotifyException as e:
+            # A real rate limit response carries headers; spotipy's synthetic 429s do not
+            if e.http_status != 429 or not e.headers or attempt == MAX_RETRIES - 1:
+                raise
+            try:
+                retry_after = int(e.headers.get('Retry-After', 1))
+            except (TypeError, ValueError):
+                retry_after = 1
+            # Don't tie up a request thread for a long rate-limit window
+            if retry_after > MAX_RETRY_AFTER:
+                raise
+            logger.warning(f"Rate limited by Spotify, retrying in {retry_after}s")
+            time.sleep(retry_after)
+
+def page_track_ids(page):
+    """Extract the track IDs from a page of playlist items, skipping local or removed tracks."""
+    return [item['track']['id'] for item in page['items'] if item.get('track') and item['track'].get('id')]
+
+def partial_shuffle(items, lo, hi):
+    """Run the Fisher-Yates steps for positions lo..hi-1 of items in place.
+
+    Positions before lo are treated as already drawn, so consecutive calls over
+    adjacent ranges add up to one partial shuffle of the list.
+    """
+    n = len(items)
+    for i in range(lo, min(hi, n - 1)):
+        j = randrange(i, n)
+        items[i], items[j] = items[j], items[i]
+
+def draw_track_lists(tracks):
+    """Draw a disjoint random track list for each TRACK_RANGES entry.
+
+    Shuffles only as many leading positions of tracks as the lists need, in place,
+    so callers must pass a list they own.
+    """
+    total = len(tracks)
+    track_lists = {}
+    offset = 0
+    for list_name, positions in _RANGE_POSITIONS:
+        # Positions at or past total don't exist in a short playlist
+        if total >= positions.stop:
+            size = len(positions)
+        else:
+            size = len(range(positions.start, total, positions.step))
+        partial_shuffle(tracks, offset, offset + size)
+        track_lists[list_name] = tracks[offset:offset + size]
+        offset += size
+    return track_lists
+
+def playlist_names(count):
+    """Generate count adjective-animal style playlist names in one batch."""
+    return [f"{adjective} {animal}"
+            for adjective, animal in zip(choices(ADJECTIVES, k=count), choices(ANIMAL_NAMES, k=count))]